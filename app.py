@@ -1,24 +1,108 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, abort
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
 from datetime import datetime
 from flask_mail import Mail, Message
+from flask_session import Session
+from jinja2 import FileSystemBytecodeCache
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from rq import Queue, Retry
+from sqlalchemy import false, func, insert, text, update
+from sqlalchemy.orm import load_only
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
+import hashlib
+import orjson
 import pytz
+import redis
 import os
+import re
+import stat
+import tempfile
 
 from dotenv import load_dotenv
 
 # ---------------- CONFIG ----------------
 load_dotenv()
 
-app = Flask(__name__)
+def _apply_object_hook(obj, hook):
+    # Mirror json.loads(object_hook=...): call the hook on every dict, innermost first
+    if isinstance(obj, dict):
+        return hook({k: _apply_object_hook(v, hook) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return [_apply_object_hook(v, hook) for v in obj]
+    return obj
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson (used by jsonify and the session cookie)."""
+
+    def dumps(self, obj, **kwargs):
+        # Datetimes go through self.default so they keep Flask's HTTP date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        obj = orjson.loads(s)
+        # The session serializer untags values through object_hook
+        if kwargs.get("object_hook"):
+            obj = _apply_object_hook(obj, kwargs["object_hook"])
+        return obj
+
+# Product images are stored under content-hashed names (see save_product_image),
+# so a URL never changes content and browsers can cache it for a year.
+PRODUCT_IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+class StoreFlask(Flask):
+    def get_send_file_max_age(self, filename):
+        if filename and filename.startswith("uploads/products/"):
+            return PRODUCT_IMAGE_MAX_AGE
+        return super().get_send_file_max_age(filename)
+
+app = StoreFlask(__name__)
+app.json = OrjsonProvider(app)
+app.json.sort_keys = False
+app.json.compact = True
+
+# Compiled templates persist across worker restarts. Auto-reload stays
+# at Flask's default (on only in debug mode).
+def make_bytecode_cache():
+    # Jinja executes whatever it loads from this directory, so it must be
+    # private to us. Without JINJA_CACHE_DIR, Jinja's own per-user 0700
+    # directory (with the same ownership check) is used.
+    cache_dir = os.getenv("JINJA_CACHE_DIR")
+    if not cache_dir:
+        return FileSystemBytecodeCache()
+
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    st = os.lstat(cache_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(
+            f"JINJA_CACHE_DIR {cache_dir} must be a directory owned by this user with mode 0700"
+        )
+    return FileSystemBytecodeCache(cache_dir)
+
+app.jinja_options = {
+    **app.jinja_options,
+    "bytecode_cache": make_bytecode_cache(),
+}
 
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Per worker process. A gunicorn worker never holds more connections than
+# it has threads, so the pool matches GUNICORN_THREADS (see gunicorn.conf.py)
+# and Postgres needs max_connections >= workers x threads.
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_pre_ping": True
+    "pool_pre_ping": True,
+    "pool_size": int(os.getenv("DB_POOL_SIZE", os.getenv("GUNICORN_THREADS", 4))),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 0)),
+    "pool_recycle": 1800
 }
 
 if not app.config["SQLALCHEMY_DATABASE_URI"]:
@@ -31,6 +115,22 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
 
+# ----------------SESSION CONFIG ----------------
+# Keep the session (cart, admin login) in Redis so the cookie only carries
+# the session id. Without REDIS_URL (local dev) Flask's signed cookie is used.
+REDIS_URL = os.getenv("REDIS_URL")
+redis_conn = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+if redis_conn:
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis_conn
+    # Browser-session cookie like before, and only write to Redis when the
+    # session actually changes (not on every request, e.g. product images)
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+    Session(app)
+
+
 # ----------------EMAIL CONFIG ----------------
 app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")       # contoh: smtp.gmail.com
 app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", 587)) # default TLS
@@ -42,12 +142,19 @@ app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_USERNAME")
 
 mail = Mail(app)
 
+# Emails are sent by an RQ worker (worker.py) so SMTP latency stays
+# off the request path. Without Redis they are sent inline.
+email_queue = Queue("emails", connection=redis_conn) if redis_conn else None
+
 db = SQLAlchemy(app)
 MALAYSIA_TZ = pytz.timezone("Asia/Kuala_Lumpur")
 
 @app.context_processor
 def inject_datetime_malaysia():
-    return dict(datetime_malaysia=datetime.now(MALAYSIA_TZ))
+    # Computed once per request, however many templates render
+    if "datetime_malaysia" not in g:
+        g.datetime_malaysia = datetime.now(MALAYSIA_TZ)
+    return dict(datetime_malaysia=g.datetime_malaysia)
 
 # ---------------- MODELS ----------------
 class Product(db.Model):
@@ -57,6 +164,8 @@ class Product(db.Model):
     price = db.Column(db.Float)
     image = db.Column(db.String(200))  
     stock = db.Column(db.Integer, default=0)
+    # Maintained by the product_search_tsv trigger (see SCHEMA_STATEMENTS)
+    search_tsv = db.deferred(db.Column(TSVECTOR))
 
 class Admin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -73,54 +182,137 @@ class OnlineOrder(db.Model):
     receipt = db.Column(db.String(200))
     payment_method = db.Column(db.String(50)) 
     status = db.Column(db.String(30), default="pending")
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    total_amount = db.Column(db.Float)  # NULL for orders placed before this column existed
 
 
 class OnlineOrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("online_order.id"))
+    order_id = db.Column(db.Integer, db.ForeignKey("online_order.id"), index=True)
     product_name = db.Column(db.String(100))
     qty = db.Column(db.Integer)
     price = db.Column(db.Float)
 
+class OrderDaySeq(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False)
+
 class InventoryTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey("product.id"))
     added_stock = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     product = db.relationship("Product", backref="inventory_transactions")
 
 
 # ---------------- HELPERS ----------------
+# argon2id tuned to roughly 50ms per hash. Hashes from werkzeug's
+# generate_password_hash are still accepted and upgraded on login.
+password_hasher = PasswordHasher(time_cost=3, memory_cost=19456, parallelism=1)
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+def verify_password(stored, password):
+    if not stored.startswith("$argon2"):
+        return check_password_hash(stored, password)
+    try:
+        return password_hasher.verify(stored, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def password_needs_rehash(stored):
+    return not stored.startswith("$argon2") or password_hasher.check_needs_rehash(stored)
+
 def get_cart():
-    return session.get("cart", {})
+    # Read the session once per request; views mutate and reassign this dict
+    if "cart" not in g:
+        g.cart = session.get("cart", {})
+    return g.cart
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+def save_upload(file, folder, digest_size=16, keep_name=False):
+    # Stream the upload to a temp file while hashing it, then move it to a
+    # content-addressed name. Identical content is only stored once.
+    os.makedirs(folder, exist_ok=True)
+    hasher = hashlib.blake2b(digest_size=digest_size)
+    fd, tmp_path = tempfile.mkstemp(dir=folder)
+    try:
+        with os.fdopen(fd, "wb", buffering=0) as fh:
+            while chunk := file.stream.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                fh.write(chunk)
+    except BaseException:
+        # Don't leave a partial file behind (static/ is publicly served)
+        os.remove(tmp_path)
+        raise
+
+    name = secure_filename(file.filename)
+    if keep_name:
+        filename = f"{hasher.hexdigest()}-{name}"
+    else:
+        filename = hasher.hexdigest() + os.path.splitext(name)[1].lower()
+
+    final_path = os.path.join(folder, filename)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+    else:
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600 files
+        os.replace(tmp_path, final_path)
+    return filename
+
+def save_product_image(image_file):
+    folder = os.path.join(app.static_folder, "uploads/products")
+    return save_upload(image_file, folder, digest_size=8, keep_name=True)
+
+def get_product(pid):
+    # Request-scoped cache in front of the ORM lookup
+    cache = g.setdefault("product_cache", {})
+    if pid not in cache:
+        cache[pid] = db.session.get(Product, pid)
+    return cache[pid]
 
 def cart_total(cart):
     return sum(i["price"] * i["qty"] for i in cart.values())
 
 def order_total(order_id):
+    # Served from the session identity map when the order is already loaded
+    order = db.session.get(OnlineOrder, order_id)
+    if order and order.total_amount is not None:
+        return order.total_amount
     items = OnlineOrderItem.query.filter_by(order_id=order_id).all()
     return sum(item.price * item.qty for item in items)
 
+def send_email(subject, recipients, body=None, html=None):
+    # RQ job, runs in the worker process outside any request
+    with app.app_context():
+        mail.send(Message(subject=subject, recipients=recipients, body=body, html=html))
+
+def queue_email(**kwargs):
+    if email_queue:
+        # Enqueue by dotted path so it resolves in the worker even when
+        # this file runs as __main__ (worker.py has it imported already)
+        email_queue.enqueue("app.send_email", kwargs=kwargs, retry=Retry(max=3, interval=60))
+    else:
+        send_email(**kwargs)
+
 @app.context_processor
 def utility_processor():
     return dict(order_total=order_total)
 
 def generate_order_no():
-    today = datetime.now(MALAYSIA_TZ).strftime("%Y%m%d")
-    for _ in range(5):
-        last_order = OnlineOrder.query.filter(
-            OnlineOrder.order_no.like(f"{today}-%")
-        ).order_by(OnlineOrder.id.desc()).first()
-
-        new_seq = int(last_order.order_no.split("-")[1]) + 1 if last_order else 1
-        order_no = f"{today}-{new_seq:04d}"
-
-        if not OnlineOrder.query.filter_by(order_no=order_no).first():
-            return order_no
-
-    raise Exception("Failed to generate unique order number")
+    # Atomic per-day counter: the upsert locks today's row until commit,
+    # so concurrent checkouts can never get the same number.
+    today = datetime.now(MALAYSIA_TZ).date()
+    stmt = pg_insert(OrderDaySeq).values(day=today, last_seq=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrderDaySeq.day],
+        set_={"last_seq": OrderDaySeq.last_seq + 1},
+    ).returning(OrderDaySeq.last_seq)
+    seq = db.session.execute(stmt).scalar_one()
+    return f"{today:%Y%m%d}-{seq:04d}"
 
 
 
@@ -134,9 +326,18 @@ def store():
     # Start the query (filtering out items with 0 stock)
     query = Product.query.filter(Product.stock > 0)
 
-    # Apply search filter if user typed something
+    # Apply search filter if user typed something.
+    # Every word is matched as a prefix ("prod" finds "Produk A"), and the
+    # 'simple' config must match the trigger so the GIN index is used.
     if search_query:
-        query = query.filter(Product.name.ilike(f"%{search_query}%"))
+        words = re.findall(r"[^\W_]+", search_query)
+        if words:
+            tsquery = " & ".join(f"{word}:*" for word in words)
+            query = query.filter(
+                Product.search_tsv.op("@@")(func.to_tsquery("simple", tsquery))
+            )
+        else:
+            query = query.filter(false())
 
     # Apply category filter if selected (Requires 'category' column in Product model)
     if category_query:
@@ -155,7 +356,7 @@ def store():
 
 @app.route("/product/<int:pid>", methods=["GET","POST"])
 def product_detail(pid):
-    product = Product.query.get_or_404(pid)
+    product = get_product(pid) or abort(404)
     if request.method=="POST":
         cart = get_cart()
         cart[str(pid)] = {
@@ -169,7 +370,8 @@ def product_detail(pid):
 
 @app.route("/cart")
 def cart():
-    return render_template("store/cart.html", cart=get_cart(), total=cart_total(get_cart()))
+    cart = get_cart()
+    return render_template("store/cart.html", cart=cart, total=cart_total(cart))
 
 @app.route("/cart/update/<int:pid>", methods=["POST"])
 def update_cart(pid):
@@ -213,56 +415,74 @@ def checkout():
         return redirect(url_for("store"))
 
     if request.method == "POST":
-        # 1️⃣ Check stock
+        # 1️⃣ Read the form and save the receipt before taking any row
+        # locks: the multipart body is only read from the client here.
+        # A receipt left behind by a failed stock check is harmless (it is
+        # content-addressed and may be shared with other orders).
+        customer = dict(
+            customer_name=request.form["name"],
+            email=request.form["email"],
+            phone=request.form["phone"],
+            address=request.form["address"],
+            payment_method=request.form["payment_method"]
+        )
+        filename = save_upload(request.files["receipt"], app.config["UPLOAD_FOLDER"])
+
+        # 2️⃣ Check stock (one query, rows locked until the final commit).
+        # Locking in id order means two checkouts sharing products queue
+        # behind each other instead of deadlocking.
+        ids = [int(pid) for pid in cart]
+        locked = (
+            Product.query.filter(Product.id.in_(ids))
+            .order_by(Product.id)
+            .with_for_update()
+            .all()
+        )
+        g.setdefault("product_cache", {}).update((p.id, p) for p in locked)
         for pid, item in cart.items():
-            product = Product.query.get(int(pid))
+            product = get_product(int(pid))
             if not product or product.stock < item["qty"]:
+                db.session.rollback()
                 flash(f"Not enough stock for {item['name']}", "danger")
                 return redirect(url_for("cart"))
 
-        # 2️⃣ Save receipt
-        file = request.files["receipt"]
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-
         # 3️⃣ Create order
+        total_amount = cart_total(cart)
         order = OnlineOrder(
             order_no=generate_order_no(),
-            customer_name=request.form["name"],
-            email=request.form["email"],
-            phone=request.form["phone"],
-            address=request.form["address"],
-            payment_method=request.form["payment_method"],
-            receipt=filename
+            receipt=filename,
+            total_amount=total_amount,
+            **customer
         )
         db.session.add(order)
-        db.session.commit()
-
-        session["last_order_id"] = order.id
+        db.session.flush()
 
         # 4️⃣ Save order items & reduce stock
         for pid, item in cart.items():
-            product = Product.query.get(int(pid))
-            product.stock -= item["qty"]
+            get_product(int(pid)).stock -= item["qty"]
 
-            db.session.add(OnlineOrderItem(
+        # One executemany INSERT instead of a unit-of-work object per item
+        db.session.execute(insert(OnlineOrderItem), [
+            dict(
                 order_id=order.id,
                 product_name=item["name"],
                 qty=item["qty"],
                 price=item["price"]
-            ))
+            )
+            for item in cart.values()
+        ])
 
         db.session.commit()
 
-        total_amount = cart_total(cart)
+        session["last_order_id"] = order.id
 
         # 5️⃣ Clear cart
         session.pop("cart", None)
 
-        # 6️⃣ Send Email Notifications
+        # 6️⃣ Queue Email Notifications
         try:
             # 📨 Email to Seller
-            seller_msg = Message(
+            queue_email(
                 subject=f"New Order: {order.order_no}",
                 recipients=[app.config["MAIL_USERNAME"]],
                 body=f"""
@@ -278,7 +498,6 @@ Total: RM{total_amount:.2f}
 Sila semak order dalam admin panel.
 """
             )
-            mail.send(seller_msg)
 
             # 📨 Email to Customer
             items_list = "\n".join([
@@ -286,7 +505,7 @@ Sila semak order dalam admin panel.
                 for item in cart.values()
             ])
 
-            customer_msg = Message(
+            queue_email(
                 subject=f"Order Confirmation - {order.order_no}",
                 recipients=[order.email],
                 body=f"""
@@ -306,10 +525,9 @@ Kami akan proses order anda secepat mungkin.
 Thank you for shopping with us!
 """
             )
-            mail.send(customer_msg)
 
         except Exception as e:
-            print("Email sending failed:", e)
+            print("Email queueing failed:", e)
 
         return redirect(url_for("success"))
 
@@ -333,13 +551,18 @@ def success():
 
 
 # ---------------- ADMIN ----------------
+ADMIN_PAGE_SIZE = 50
+
 @app.route("/admin/login", methods=["GET","POST"])
 def admin_login():
     if request.method=="POST":
         username = request.form["username"]
         password = request.form["password"]
         admin = Admin.query.filter_by(username=username).first()
-        if admin and check_password_hash(admin.password, password):
+        if admin and verify_password(admin.password, password):
+            if password_needs_rehash(admin.password):
+                admin.password = hash_password(password)
+                db.session.commit()
             session["admin"] = admin.id
             return redirect(url_for("admin_orders"))
         else:
@@ -357,13 +580,33 @@ def admin_logout():
 def admin_orders():
     if "admin" not in session:
         return redirect(url_for("admin_login"))
-    orders = OnlineOrder.query.all()
-    return render_template("admin/orders.html", orders=orders)
+    page = request.args.get("page", 1, type=int)
+    # Only the columns the list shows; address/receipt stay in the DB
+    pagination = OnlineOrder.query.options(load_only(
+        OnlineOrder.id, OnlineOrder.order_no, OnlineOrder.customer_name,
+        OnlineOrder.phone, OnlineOrder.status, OnlineOrder.created_at
+    )).order_by(OnlineOrder.id.desc()).paginate(
+        page=page, per_page=ADMIN_PAGE_SIZE, error_out=False
+    )
+    return render_template("admin/orders.html", orders=pagination.items, pagination=pagination)
 
 @app.route("/admin/order/<int:oid>", methods=["GET","POST"])
 def admin_order_detail(oid):
     if "admin" not in session:
         return redirect(url_for("admin_login"))
+
+    if request.method == "POST":
+        # Single UPDATE, no need to load the order or its items first
+        result = db.session.execute(
+            update(OnlineOrder)
+            .where(OnlineOrder.id == oid)
+            .values(status=request.form["status"])
+        )
+        if result.rowcount == 0:
+            abort(404)
+        db.session.commit()
+        # After a POST, we should redirect or refresh the data
+        return redirect(url_for('admin_order_detail', oid=oid))
         
     order = OnlineOrder.query.get_or_404(oid)
     items = OnlineOrderItem.query.filter_by(order_id=oid).all()
@@ -371,12 +614,6 @@ def admin_order_detail(oid):
     # Calculate the total here
     total_amount = sum(item.qty * item.price for item in items)
     
-    if request.method == "POST":
-        order.status = request.form["status"]
-        db.session.commit()
-        # After a POST, we should redirect or refresh the data
-        return redirect(url_for('admin_order_detail', oid=oid))
-        
     return render_template("admin/order_detail.html", 
                            order=order, 
                            items=items, 
@@ -387,8 +624,11 @@ def admin_inventory():
     if "admin" not in session:
         return redirect(url_for("admin_login"))
 
-    transactions = InventoryTransaction.query.order_by(InventoryTransaction.created_at.desc()).all()
-    return render_template("admin/inventory.html", transactions=transactions)
+    page = request.args.get("page", 1, type=int)
+    pagination = InventoryTransaction.query.order_by(
+        InventoryTransaction.created_at.desc()
+    ).paginate(page=page, per_page=ADMIN_PAGE_SIZE, error_out=False)
+    return render_template("admin/inventory.html", transactions=pagination.items, pagination=pagination)
 
 
 # ---------------- ADMIN PRODUCT MANAGEMENT ----------------
@@ -411,9 +651,7 @@ def admin_add_product():
         image_file = request.files.get("image")
         filename = None
         if image_file and image_file.filename != '':
-            filename = secure_filename(image_file.filename)
-            os.makedirs(os.path.join(app.static_folder,"uploads/products"), exist_ok=True)
-            image_file.save(os.path.join(app.static_folder,"uploads/products", filename))
+            filename = save_product_image(image_file)
         product = Product(name=name, description=description, price=price, image=filename, stock=stock)
         db.session.add(product)
         db.session.commit()
@@ -439,10 +677,7 @@ def admin_edit_product(pid):
 
         image_file = request.files.get("image")
         if image_file and image_file.filename != '':
-            filename = secure_filename(image_file.filename)
-            os.makedirs(os.path.join(app.static_folder,"uploads/products"), exist_ok=True)
-            image_file.save(os.path.join(app.static_folder,"uploads/products", filename))
-            product.image = filename
+            product.image = save_product_image(image_file)
 
         db.session.commit()
         flash("Product updated successfully","success")
@@ -500,7 +735,7 @@ def admin_manage_admins():
         else:
             new_admin = Admin(
                 username=username,
-                password=generate_password_hash(password)
+                password=hash_password(password)
             )
             db.session.add(new_admin)
             db.session.commit()
@@ -519,7 +754,7 @@ def admin_change_password(aid):
 
     if request.method == "POST":
         new_password = request.form["new_password"]
-        admin.password = generate_password_hash(new_password)
+        admin.password = hash_password(new_password)
         db.session.commit()
         flash(f"Password for '{admin.username}' updated successfully", "success")
         return redirect(url_for("admin_manage_admins"))
@@ -539,22 +774,21 @@ def admin_send_invoice(oid):
     total_amount = sum(item.price * item.qty for item in items)
 
     try:
-        # Create a professional HTML version of the invoice for the email
-        msg = Message(
-            subject=f"Invoice for Order #{order.order_no}",
-            recipients=[order.email],
-        )
-        
-        # We use render_template to create a clean HTML email body
-        msg.html = render_template(
+        # We use render_template to create a clean HTML email body.
+        # Rendered here because the template needs the request for url_for.
+        html = render_template(
             "admin/email_invoice.html", 
             order=order, 
             items=items, 
             total=total_amount
         )
         
-        mail.send(msg)
-        flash(f"Invoice sent successfully to {order.email}", "success")
+        queue_email(
+            subject=f"Invoice for Order #{order.order_no}",
+            recipients=[order.email],
+            html=html
+        )
+        flash(f"Invoice queued for sending to {order.email}", "success")
     except Exception as e:
         flash(f"Failed to send email: {str(e)}", "danger")
         
@@ -586,11 +820,84 @@ def track_order():
 
 
 # ---------------- INIT DATABASE ----------------
+# db.create_all() only creates missing tables, so indexes and other schema
+# additions for existing tables are applied here. Every statement must be
+# idempotent because it runs on every boot.
+SCHEMA_STATEMENTS = [
+    # Trigram index lets Postgres serve the category ILIKE '%...%' from an
+    # index instead of scanning the whole product table.
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Name search uses search_tsv below; nothing filters on name ILIKE
+    "DROP INDEX IF EXISTS ix_product_name_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_product_description_trgm "
+    "ON product USING gin (description gin_trgm_ops)",
+    # Full-text search column kept in sync by a trigger
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS search_tsv tsvector",
+    """
+    CREATE OR REPLACE FUNCTION product_search_tsv_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_tsv := to_tsvector(
+            'simple', coalesce(NEW.name, '') || ' ' || coalesce(NEW.description, '')
+        );
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    # Only touch the trigger (ACCESS EXCLUSIVE on product) when it is missing
+    # or still the older version that also fired on stock updates
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgrelid = 'product'::regclass
+              AND tgname = 'product_search_tsv'
+              AND pg_get_triggerdef(oid) LIKE '%UPDATE OF name, description%'
+        ) THEN
+            DROP TRIGGER IF EXISTS product_search_tsv ON product;
+            CREATE TRIGGER product_search_tsv
+                BEFORE INSERT OR UPDATE OF name, description ON product
+                FOR EACH ROW EXECUTE FUNCTION product_search_tsv_update();
+        END IF;
+    END
+    $$
+    """,
+    # Backfill rows created before the trigger existed
+    "UPDATE product SET search_tsv = to_tsvector("
+    "'simple', coalesce(name, '') || ' ' || coalesce(description, '')) "
+    "WHERE search_tsv IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_product_search_gin "
+    "ON product USING gin (search_tsv)",
+    "ALTER TABLE online_order ADD COLUMN IF NOT EXISTS total_amount double precision",
+    # Same names as the index=True columns, for tables that already existed
+    "CREATE INDEX IF NOT EXISTS ix_online_order_item_order_id "
+    "ON online_order_item (order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_online_order_created_at "
+    "ON online_order (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_inventory_transaction_created_at "
+    "ON inventory_transaction (created_at)",
+    # Seed today's order counter from orders placed before it existed. Only
+    # today can still receive orders, and the created_at bound keeps this
+    # an index range scan over at most a day of orders.
+    "INSERT INTO order_day_seq (day, last_seq) "
+    "SELECT (now() AT TIME ZONE 'Asia/Kuala_Lumpur')::date, "
+    "max(split_part(order_no, '-', 2)::int) "
+    "FROM online_order "
+    "WHERE created_at >= (now() AT TIME ZONE 'UTC') - interval '1 day' "
+    "AND order_no LIKE to_char(now() AT TIME ZONE 'Asia/Kuala_Lumpur', 'YYYYMMDD') || '-%' "
+    "HAVING count(*) > 0 "
+    "ON CONFLICT (day) DO NOTHING",
+]
+
 def init_db():
     db.create_all()
 
+    for statement in SCHEMA_STATEMENTS:
+        db.session.execute(text(statement))
+    db.session.commit()
+
     if not Admin.query.first():
-        admin = Admin(username="admin", password=generate_password_hash("admin123"))
+        admin = Admin(username="admin", password=hash_password("admin123"))
         db.session.add(admin)
         db.session.commit()
 
@@ -600,12 +907,17 @@ def init_db():
         db.session.commit()
 
 # ---------------- CALL INIT_DB SAFELY ----------------
-# Hapus @app.before_first_request
-# Panggil dengan app context supaya compatible dengan Gunicorn / Railway
-with app.app_context():
+# Not called at import time: gunicorn workers and the RQ worker import this
+# module, and init_db() takes locks on product. gunicorn runs it once per
+# deploy (when_ready in gunicorn.conf.py); with `flask run` use
+# `flask --app app init-db`.
+@app.cli.command("init-db")
+def init_db_command():
     init_db()
 
 # ---------------- RUN LOCAL ----------------
 if __name__ == "__main__":
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000)
 
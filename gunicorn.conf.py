@@ -0,0 +1,40 @@
+# Loaded automatically by `gunicorn app:app` (see Procfile)
+import os
+
+
+def usable_cpus():
+    # Like nproc: CPUs this process may run on, not every CPU on the host
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Each worker holds up to `threads` DB connections, so workers x threads
+# must stay below Postgres max_connections (100 by default)
+workers = int(os.getenv("WEB_CONCURRENCY", usable_cpus()))
+worker_class = "gthread"
+# Also the default DB pool size per worker (see app.py)
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# Import the app once in the master so workers share its memory pages
+# copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # Schema bootstrap runs once per deploy, in the master, before any
+    # worker is forked
+    from app import app, db, init_db
+
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    # The master opened DB connections while preloading; a forked worker
+    # must not reuse them, so give it a fresh pool
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,11 @@
+# RQ worker for the "emails" queue (see Procfile).
+# Importing app here, once, means the work-horse forked for each job finds
+# it in sys.modules instead of importing app.py again per job.
+from rq import Worker
+
+from app import email_queue, redis_conn
+
+if __name__ == "__main__":
+    if email_queue is None:
+        raise SystemExit("REDIS_URL not set; emails are sent inline without a worker")
+    Worker([email_queue], connection=redis_conn).work()